@@ -23,11 +23,17 @@
 """
 This module exposes engine from SQLAlchemy.
 
+Engines keep a pool of connections. There is no reconnect loop: when a
+statement fails because the server went away, SQLAlchemy invalidates the pool
+and the error is raised to the caller; new connections are opened on demand
+at the next checkout, without any fixed sleep. Callers that want to retry
+should do it themselves (with backoff) around their unit of work.
+
 @author  Jacek Becla, SLAC
 """
 
 # standard library imports
-from configparser import ConfigParser, NoSectionError
+from configparser import ConfigParser, NoOptionError, NoSectionError
 
 import logging as log
 import os
@@ -36,6 +42,13 @@ import os
 import sqlalchemy
 from sqlalchemy.engine.url import URL, make_url
 
+_LOG = log.getLogger(__name__)
+
+# Pooled connections older than this (in seconds) are replaced when checked
+# out. This guards against connections closed by the server (wait_timeout)
+# without pinging the server before every statement.
+_POOL_RECYCLE = 3600
+
 
 ####################################################################################
 
@@ -70,20 +83,28 @@ def getEngineFromFile(fileName,
     echo = yes
     pool_size = 5
 
+    Unless "pool_recycle" is given in the file, pooled connections are
+    recycled after an hour.
+
+    The engine is created lazily, no connection to the server is made until
+    the engine is first used.
+
     Raises IOError if the file does not exists.
-    Raises ConfigParser exceptions (such as NoSectionError)
+    Raises ConfigParser exceptions (such as NoSectionError, or NoOptionError
+    if "url" is missing)
     """
     fileName = os.path.expanduser(fileName)
     parser = ConfigParser()
     with open(fileName) as config:
-        # readfp is deprecated in Python3.x, read_file is not in Python2
-        read_file = getattr(parser, "read_file", None) or getattr(parser, "readfp")
-        read_file(config, fileName)
+        parser.read_file(config, fileName)
     try:
         options = dict(parser.items("database"))
     except NoSectionError:
-        log.error("File %s does not contain section 'database'", fileName)
+        _LOG.error("File %s does not contain section 'database'", fileName)
         raise
+    if "url" not in options:
+        _LOG.error("File %s does not define 'url' in section 'database'", fileName)
+        raise NoOptionError("url", "database")
 
     if drivername or username or password or host or port or database or query:
         url = make_url(options['url'])
@@ -96,13 +117,17 @@ def getEngineFromFile(fileName,
         if host:
             url.host = host
         if port:
-            url.port = port
+            # URL() converts port to int, do the same when overriding it
+            url.port = int(port) if isinstance(port, str) else port
         if database:
             url.database = database
         if query:
-            url.query = query
+            # shallow copy, the engine must not share the dict with the caller
+            url.query = dict(query)
         options['url'] = url
 
+    if "pool" not in options:
+        options.setdefault("pool_recycle", _POOL_RECYCLE)
     return sqlalchemy.engine_from_config(options, "")
 
 ####################################################################################
@@ -124,12 +149,21 @@ def getEngineFromArgs(drivername="mysql+mysqldb",
     Note, if mysql sees "localhost" it switches to using socket, even if port is
     specified. Commonly used way around it is to specify "127.0.0.1" as port for
     local access.
+
+    Unless "pool_recycle" or "pool" is passed through engineKVArgs, pooled
+    connections are recycled after an hour.
+
+    The engine is created lazily, no connection to the server is made until
+    the engine is first used.
     """
+    # create_engine() rejects pool_recycle together with a ready-made pool
+    if "pool" not in engineKVArgs:
+        engineKVArgs.setdefault("pool_recycle", _POOL_RECYCLE)
     url = URL(drivername=drivername,
               username=username,
               password=password,
               host=host,
               port=port,
               database=database,
-              query=query)
+              query=dict(query) if query else query)
     return sqlalchemy.create_engine(url, **engineKVArgs)
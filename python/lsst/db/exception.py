@@ -34,14 +34,18 @@ Known issues:
 def _myEx_init(self, errCode, *messages):
     self._errCode = errCode
     self._messages = messages
+    self._str = None
 
 
 def _myEx_str(self):
-    msg = self._errorMessages.get(self._errCode) or (
-        "Unrecognized error: %r" % self._errCode)
-    if self._messages:
-        msg = msg + " (" + "), (".join(self._messages) + ")"
-    return msg
+    # the message never changes, build it once
+    if self._str is None:
+        msg = self._errorMessages.get(self._errCode) or (
+            "Unrecognized error: %r" % self._errCode)
+        if self._messages:
+            msg = msg + " (" + "), (".join(self._messages) + ")"
+        self._str = msg
+    return self._str
 
 
 def _myEx_errCode(self):
@@ -26,19 +26,24 @@ in particular these that are specific to different drivers.
 """
 
 # standard library
+import functools
 import logging as log
 import os
 import subprocess
 import tempfile
+import time
+import weakref
 
 # third party
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import DBAPIError, NoSuchModuleError, \
     NoSuchTableError, OperationalError, ProgrammingError
-from sqlalchemy.inspection import inspect
 
 # TODO: explicit dependency on MySQLdb, should get rid of this
 from MySQLdb.constants import FIELD_TYPE
 
+_LOG = log.getLogger(__name__)
+
 
 # MySQL errors that we are catching
 # Names and numbers from include/mysql/mysql.h
@@ -67,9 +72,70 @@ class DatabaseExistsError(ProgrammingError):
 class TableExistsError(ProgrammingError):
     """Table already exists."""
 
+#### Metadata cache ################################################################
+
+# Answers of dbExists(), tableExists(), isView() and userExists() per engine,
+# maps engine to {key: (answer, expiry time)}. Disabled when ttl is 0.
+_metaCache = weakref.WeakKeyDictionary()
+_metaCacheTtl = 0
+
+
+def setMetaCacheTtl(ttl):
+    """
+    Cache answers of dbExists(), tableExists(), isView() and userExists()
+    for <ttl> seconds. Caching is disabled by default (ttl = 0).
+
+    @param ttl         Time to keep cached answers, in seconds, 0 disables
+                       the cache.
+
+    The cache is cleared by functions from this module that create or drop
+    databases or tables. Changes made by other means (conn.execute(), other
+    processes) are not noticed until the cached answers expire.
+    """
+    global _metaCacheTtl
+    _metaCacheTtl = ttl
+    _metaCache.clear()
+
+
+def _getCached(conn, key):
+    """
+    Return the cached answer for <key>, or None if there is no valid one.
+    """
+    if _metaCacheTtl <= 0:
+        return None
+    entry = _metaCache.get(conn.engine, {}).get(key)
+    if entry is None or entry[1] < time.monotonic():
+        return None
+    return entry[0]
+
+
+def _putCached(conn, key, value):
+    """
+    Remember answer <value> for <key>, return <value>.
+    """
+    if _metaCacheTtl > 0:
+        cache = _metaCache.setdefault(conn.engine, {})
+        cache[key] = (value, time.monotonic() + _metaCacheTtl)
+    return value
+
+
+def _invalidatesMetaCache(func):
+    """
+    Decorator for functions that create or drop databases or tables,
+    clears the metadata cache of the engine once the function returns.
+    """
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        try:
+            return func(conn, *args, **kwargs)
+        finally:
+            _metaCache.pop(conn.engine, None)
+    return wrapper
+
 #### Database-related functions ####################################################
 
 
+@_invalidatesMetaCache
 def createDb(conn, dbName, mayExist=False):
     """
     Create database <dbName>.
@@ -90,7 +156,7 @@ def createDb(conn, dbName, mayExist=False):
 
     # consider using create_database from helpers:
     # http://sqlalchemy-utils.readthedocs.org/en/latest/database_helpers.html
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         try:
             conn.execute("CREATE DATABASE `%s`" % dbName)
         except ProgrammingError as e:
@@ -113,7 +179,7 @@ def useDb(conn, dbName):
     Raises NoSuchDatabaseError if the databases does not exists.
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         try:
             conn.execute("USE `%s`" % dbName)
         except DBAPIError as e:
@@ -133,9 +199,14 @@ def dbExists(conn, dbName):
 
     Raises sqlalchemy exceptions.
     """
-    return dbName in inspect(conn).get_schema_names()
+    key = ("db", dbName)
+    exists = _getCached(conn, key)
+    if exists is None:
+        exists = _putCached(conn, key, dbName in _schemaNames(conn))
+    return exists
 
 
+@_invalidatesMetaCache
 def dropDb(conn, dbName, mustExist=True):
     """
     Drop database <dbName>.
@@ -150,13 +221,13 @@ def dropDb(conn, dbName, mustExist=True):
 
     Disconnect from the database if it is the current database.
     """
-    if not mustExist and not dbExists(conn, dbName):
-        return
     # consider using create_database from helpers:
     # http://sqlalchemy-utils.readthedocs.org/en/latest/database_helpers.html
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
+        # IF EXISTS lets the server skip missing database, no need to ask first
+        cmd = "DROP DATABASE `%s`" if mustExist else "DROP DATABASE IF EXISTS `%s`"
         try:
-            conn.execute("DROP DATABASE `%s`" % dbName)
+            conn.execute(cmd % dbName)
         except DBAPIError as e:
             if e.orig.args[0] == MySqlErr.ER_DB_DROP_EXISTS:
                 raise NoSuchDatabaseError("DROP DATABASE", dbName, e.orig)
@@ -174,7 +245,16 @@ def listDbs(conn):
 
     Raises sqlalchemy exceptions.
     """
-    return inspect(conn).get_schema_names()
+    return _schemaNames(conn)
+
+
+def _schemaNames(conn):
+    """
+    Return list of databases, same as inspect(conn).get_schema_names() but
+    without creating an inspector (which, for an engine, also checks out
+    a connection just to close it again).
+    """
+    return conn.dialect.get_schema_names(conn)
 
 
 #### Table-related functions #######################################################
@@ -191,17 +271,34 @@ def tableExists(conn, tableName, dbName=None):
     Raises sqlalchemy exceptions.
     """
 
+    if not dbName:
+        if not conn.engine.url.database:
+            return False
+        dbName = conn.engine.url.database
+
+    key = ("table", dbName, tableName)
+    exists = _getCached(conn, key)
+    if exists is not None:
+        return exists
+
+    if conn.dialect.name == "mysql":
+        # one query checks both the database and the table, this saves
+        # a round trip compared to calling dbExists() first
+        exists = conn.execute("SELECT COUNT(*) FROM information_schema.tables "
+                              "WHERE table_schema=%s AND table_name=%s",
+                              (dbName, tableName)).scalar() > 0
     # sqlalchemy will throw exception if we call has_table("nonExistentDb", "t")
     # and we are not connected to any database. The code below fixes that bug
-    if dbName:
-        if not dbExists(conn, dbName):
-            return False
-        return conn.engine.has_table(tableName, dbName)
-    elif not conn.engine.url.database:
-        return False
-    return conn.engine.has_table(tableName)
+    elif not dbExists(conn, dbName):
+        exists = False
+    else:
+        # run it through the connection we were given, conn.engine.has_table()
+        # would check out (and possibly open) another connection from the pool
+        exists = conn.run_callable(conn.dialect.has_table, tableName, dbName)
+    return _putCached(conn, key, exists)
 
 
+@_invalidatesMetaCache
 def createTable(conn, tableName, tableSchema, dbName=None, mayExist=False):
     """
     Create table <tableName> in database <dbName>.
@@ -220,7 +317,7 @@ def createTable(conn, tableName, tableSchema, dbName=None, mayExist=False):
     is say to False.
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         dbNameStr = "`%s`." % dbName if dbName is not None else ""
         cmd = "CREATE TABLE %s`%s` %s" % (dbNameStr, tableName, tableSchema)
         try:
@@ -238,6 +335,7 @@ def createTable(conn, tableName, tableSchema, dbName=None, mayExist=False):
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
 
 
+@_invalidatesMetaCache
 def createTableLike(conn, dbName, tableName, templDb, templTable):
     """
     Create table <dbName>.<tableName> like <templDb>.<templTable>
@@ -253,7 +351,7 @@ def createTableLike(conn, dbName, tableName, templDb, templTable):
     Raises sqlalchemy exceptions.
     """
 
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         query = "CREATE TABLE {0}.{1} LIKE {2}.{3}".format(dbName, tableName,
                                                            templDb, templTable)
         try:
@@ -270,6 +368,7 @@ def createTableLike(conn, dbName, tableName, templDb, templTable):
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
 
 
+@_invalidatesMetaCache
 def createTableFromSchema(conn, schema):
     """
     Create database table from given schema.
@@ -281,11 +380,12 @@ def createTableFromSchema(conn, schema):
     Raises TableExistsError if the table already exists.
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         try:
             conn.execute(schema)
         except OperationalError as exc:
-            log.error('Exception when creating table: %s', exc)
+            # str(exc) would also include the whole schema, the driver error is enough
+            _LOG.error('Exception when creating table: %s', exc.orig)
             if exc.orig.args[0] == MySqlErr.ER_TABLE_EXISTS_ERROR:
                 raise TableExistsError("CREATE TABLE", "<FROM SCHEMA>", exc.orig)
             raise
@@ -293,6 +393,7 @@ def createTableFromSchema(conn, schema):
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
 
 
+@_invalidatesMetaCache
 def dropTable(conn, tableName, dbName=None, mustExist=True):
     """
     Drop table <tableName> in database <dbName>.
@@ -307,7 +408,7 @@ def dropTable(conn, tableName, dbName=None, mustExist=True):
     is set to True.
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         dbNameStr = "`%s`." % dbName if dbName is not None else ""
         try:
             conn.execute("DROP TABLE %s`%s`" % (dbNameStr, tableName))
@@ -333,10 +434,10 @@ def listTables(conn, dbName=None):
 
     # consider using inspector.get_table_names(). Issue: it needs to connect
     # to the database
-    if conn.engine.url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
         cmd = "SELECT TABLE_NAME FROM information_schema.TABLES "
-        cmd += "WHERE TABLE_SCHEMA='%s'" % dbName
-        rows = conn.execute(cmd)
+        cmd += "WHERE TABLE_SCHEMA=%s"
+        rows = conn.execute(cmd, (dbName,))
         return [x[0] for x in rows]
     else:
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
@@ -355,14 +456,27 @@ def isView(conn, tableName, dbName=None):
 
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
-        dbNameStr = "'%s'" % dbName if dbName is not None else "DATABASE()"
-        rows = conn.execute("SELECT table_type FROM information_schema.tables "
-                            "WHERE table_schema=%s AND table_name='%s'" % (dbNameStr, tableName))
+    # current database depends on the connection, only cache explicit names
+    key = ("view", dbName, tableName) if dbName is not None else None
+    if key is not None:
+        view = _getCached(conn, key)
+        if view is not None:
+            return view
+
+    if conn.dialect.name == "mysql":
+        if dbName is not None:
+            rows = conn.execute("SELECT table_type FROM information_schema.tables "
+                                "WHERE table_schema=%s AND table_name=%s",
+                                (dbName, tableName))
+        else:
+            rows = conn.execute("SELECT table_type FROM information_schema.tables "
+                                "WHERE table_schema=DATABASE() AND table_name=%s",
+                                (tableName,))
         row = rows.first()
-        if not row:
-            return False
-        return row[0] == 'VIEW'
+        view = row is not None and row[0] == 'VIEW'
+        if key is not None:
+            _putCached(conn, key, view)
+        return view
     else:
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
 
@@ -374,16 +488,154 @@ def userExists(conn, userName, hostName):
 
     Raises sqlalchemy exceptions.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
-        return conn.execute(
-            "SELECT COUNT(*) FROM mysql.user WHERE user='%s' AND host='%s'" %
-            (userName, hostName)).scalar() == 1
+    key = ("user", userName, hostName)
+    exists = _getCached(conn, key)
+    if exists is not None:
+        return exists
+
+    if conn.dialect.name == "mysql":
+        return _putCached(conn, key, conn.execute(
+            "SELECT COUNT(*) FROM mysql.user WHERE user=%s AND host=%s",
+            (userName, hostName)).scalar() == 1)
+    else:
+        raise NoSuchModuleError(conn.engine.url.get_backend_name())
+
+#### Query execution #############################################################
+@_invalidatesMetaCache
+def execCommands(conn, commands):
+    """
+    Execute several SQL statements, sending them to the server as a single
+    multi-statement batch (one round trip instead of one per statement).
+
+    @param conn        Database connection or engine.
+    @param commands    Sequence of SQL statements, without trailing ";".
+
+    Results produced by the statements are discarded. The driver has to allow
+    multiple statements per query, MySQLdb does that by default. To run one
+    parameterized statement for many rows use conn.execute(cmd, rows) instead,
+    it maps to executemany().
+
+    If <conn> is an engine, the connection used for the batch is discarded
+    afterwards rather than returned to the pool, as the commands may change its
+    session state (e.g. current database).
+
+    Raises sqlalchemy exceptions.
+    """
+    if conn.dialect.name == "mysql":
+        if commands:
+            _execMulti(conn, ";\n".join(commands))
     else:
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
 
+
+def _execMulti(conn, sql):
+    """
+    Send <sql>, which can contain many statements, in one round trip and
+    consume all results it produces.
+
+    If <conn> is an engine, the connection checked out for <sql> is
+    invalidated afterwards so that its session state does not leak into
+    the pool.
+
+    Raises sqlalchemy exceptions.
+    """
+    if isinstance(conn, Engine):
+        with conn.connect() as c:
+            try:
+                _execMulti(c, sql)
+            finally:
+                if not c.invalidated:
+                    c.invalidate()
+        return
+
+    dbapiConn = conn.connection
+    dbapiError = conn.dialect.dbapi.Error
+    cursor = dbapiConn.cursor()
+    try:
+        cursor.execute(sql)
+        # errors from statements after the first one are only reported
+        # when we get to their results, so go through all of them
+        while cursor.nextset():
+            pass
+    except dbapiError as e:
+        # the raw cursor bypasses sqlalchemy's disconnect handling, make sure
+        # a dead connection does not go back to the pool
+        isDisconnect = conn.dialect.is_disconnect(e, dbapiConn, cursor)
+        if isDisconnect:
+            conn.invalidate(e)
+        raise DBAPIError.instance(sql, None, e, dbapiError,
+                                  connection_invalidated=isDisconnect,
+                                  dialect=conn.dialect)
+    finally:
+        if not conn.invalidated:
+            cursor.close()
+    # sqlalchemy autocommit is bypassed here, do what it would have done
+    if not conn.in_transaction():
+        dbapiConn.commit()
+
+
+def iterQuery(conn, query, params=None, arraysize=1000):
+    """
+    Execute <query> and return an iterator over the resulting rows.
+
+    @param conn        Database connection or engine.
+    @param query       SQL query.
+    @param params      Optional parameters bound to the query.
+    @param arraysize   Number of rows fetched from the server at a time.
+
+    The query is executed by this call, errors are raised here rather than
+    when iterating. Rows are streamed using a server-side cursor instead of
+    being loaded into client memory all at once, use it for queries returning
+    large result sets. The connection can not be used for other queries until
+    the iteration is finished or the iterator is closed with close().
+
+    Raises sqlalchemy exceptions.
+    """
+    conn = conn.execution_options(stream_results=True)
+    if params is None:
+        result = conn.execute(query)
+    else:
+        result = conn.execute(query, params)
+    return _RowIterator(result, arraysize)
+
+
+class _RowIterator(object):
+    """
+    Iterator returned by iterQuery(), fetches rows of <result> in batches of
+    <arraysize> and closes <result> when exhausted or closed.
+    """
+
+    def __init__(self, result, arraysize):
+        self._result = result
+        self._arraysize = arraysize
+        self._rows = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for row in self._rows:
+            return row
+        if not self._result.closed:
+            rows = self._result.fetchmany(self._arraysize)
+            if rows:
+                self._rows = iter(rows[1:])
+                return rows[0]
+            self.close()
+        raise StopIteration
+
+    def close(self):
+        """
+        Release the result, remaining rows are discarded.
+        """
+        self._rows = iter(())
+        self._result.close()
+
+
 #### SQL scripts handling ########################################################
 
-def loadSqlScript(conn, script, dbName=None):
+@_invalidatesMetaCache
+def loadSqlScript(conn, script, dbName=None, useSubprocess=False):
     """
     Execute SQL from a given file.
 
@@ -393,10 +645,19 @@ def loadSqlScript(conn, script, dbName=None):
     @param script      File object (object with read() method) or file name.
     @param dbName      Optional name of the database, if specified then overrides
                        database used by connection/engine.
+    @param useSubprocess  If True, run the script through the mysql command line
+                       client instead of the connection.
+
+    By default the script is sent to the server as a single multi-statement
+    query, over a new connection from the engine of <conn>, which is discarded
+    afterwards. As with the mysql client, the script runs in its own session:
+    the current database and any open transaction of <conn> are not affected.
+    Scripts which rely on mysql client commands (e.g. DELIMITER) need
+    useSubprocess=True.
     """
 
     url = conn.engine.url
-    if url.get_backend_name() == "mysql":
+    if conn.dialect.name == "mysql":
 
         # check file, if it has 'read' attribute assume it's a file object,
         # otherwise assume it's file name, open it and close later.
@@ -405,42 +666,21 @@ def loadSqlScript(conn, script, dbName=None):
             script = open(script)
             cleanup = script.close
 
-        # write credentials and options to a temporary file, we have to
-        # close it but will delete it after mysql finishes.
-        cfg = tempfile.NamedTemporaryFile("w", delete=False)
-        fname = cfg.name
-
-        print("[client]", file=cfg)
-        print("batch", file=cfg)
-        print("quick", file=cfg)
-
-        # convert to UTF-8 if there are unicode chars, hope mysql can read it
-        if url.host:
-            print('host={}'.format(url.host), file=cfg)
-        if url.port:
-            print('port={}'.format(url.port), file=cfg)
-        socket = url.query.get('unix_socket')
-        if socket:
-            print('socket="{}"'.format(socket), file=cfg)
-        if url.username:
-            print('user="{}"'.format(url.username), file=cfg)
-        if url.password:
-            print('password="{}"'.format(url.password), file=cfg)
-        if not dbName:
-            dbName = url.database
-        if dbName:
-            print('database={}'.format(dbName), file=cfg)
-        # not all platforms can read file while it's open
-        cfg.close()
-
-        # build command line, use the options file above
         try:
-            # it will throw on errors
-            cmd = ['mysql', '--defaults-file=' + fname]
-            subprocess.check_call(cmd, stdin=script)
+            if useSubprocess:
+                _loadSqlScriptSubprocess(url, script, dbName)
+            else:
+                sql = script.read()
+                if isinstance(sql, bytes):
+                    sql = sql.decode("utf-8")
+                sql = _stripSqlComments(sql)
+                if dbName:
+                    sql = "USE `%s`;\n%s" % (dbName, sql)
+                if not sql:
+                    return
+                # separate session, like the mysql client would use
+                _execMulti(conn.engine, sql)
         finally:
-            # cleanup - remove file with credentials
-            os.unlink(fname)
             if cleanup is not None:
                 cleanup()
 
@@ -448,15 +688,113 @@ def loadSqlScript(conn, script, dbName=None):
         raise NoSuchModuleError(url.get_backend_name())
 
 
+def _stripSqlComments(sql):
+    """
+    Remove comments and surrounding whitespace from <sql>. The server rejects
+    a multi-statement query if its last "statement" is just a comment.
+    Comments of the form "/*! ... */" (executed by mysql) and optimizer hints
+    "/*+ ... */" are kept.
+    """
+    out = []
+    quote = None
+    i, n = 0, len(sql)
+    while i < n:
+        c = sql[i]
+        if quote:
+            # inside a quoted string or identifier, copy everything
+            if c == "\\" and quote != "`":
+                out.append(sql[i:i + 2])
+                i += 2
+                continue
+            if c == quote:
+                quote = None
+            out.append(c)
+            i += 1
+        elif c in "'\"`":
+            quote = c
+            out.append(c)
+            i += 1
+        elif c == "#" or (sql.startswith("--", i) and
+                          sql[i + 2:i + 3] in ("", " ", "\t", "\n", "\r")):
+            end = sql.find("\n", i)
+            i = n if end < 0 else end
+        elif sql.startswith("/*", i) and sql[i + 2:i + 3] not in ("!", "+"):
+            end = sql.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            out.append(" ")
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out).strip()
+
+
+def _loadSqlScriptSubprocess(url, script, dbName=None):
+    """
+    Execute SQL from file object <script> using mysql command line client,
+    connecting to the server described by <url>.
+    """
+
+    # collect options first and write them in one go
+    lines = ["[client]", "batch", "quick"]
+
+    # convert to UTF-8 if there are unicode chars, hope mysql can read it
+    if url.host:
+        lines.append('host={}'.format(url.host))
+    if url.port:
+        lines.append('port={}'.format(url.port))
+    socket = url.query.get('unix_socket')
+    if socket:
+        lines.append('socket="{}"'.format(socket))
+    if url.username:
+        lines.append('user="{}"'.format(url.username))
+    if url.password:
+        lines.append('password="{}"'.format(url.password))
+    if not dbName:
+        dbName = url.database
+    if dbName:
+        lines.append('database={}'.format(dbName))
+    lines.append("")
+
+    # write credentials and options to a temporary file, we have to
+    # close it but will delete it after mysql finishes.
+    cfg = tempfile.NamedTemporaryFile("w", delete=False)
+    fname = cfg.name
+    cfg.write("\n".join(lines))
+    # not all platforms can read file while it's open
+    cfg.close()
+
+    # build command line, use the options file above
+    try:
+        # it will throw on errors
+        cmd = ['mysql', '--defaults-file=' + fname]
+        subprocess.check_call(cmd, stdin=script)
+    finally:
+        # cleanup - remove file with credentials
+        os.unlink(fname)
+
+
 #### Unclassified functions ########################################################
+def _makeFieldTypeNames():
+    """
+    Return mapping of MySQL type codes to type names. Where several names share
+    a code (e.g. CHAR and TINY) the first one in alphabetical order is used.
+    """
+    names = {}
+    for name in dir(FIELD_TYPE):
+        code = getattr(FIELD_TYPE, name)
+        if isinstance(code, int):
+            names.setdefault(code, name)
+    return names
+
+
+_FIELD_TYPE_NAMES = _makeFieldTypeNames()
+
+
 def typeCode2Name(conn, code):
     """
     Convert type code to type name, returns None if there is no mapping.
     """
-    if conn.engine.url.get_backend_name() == "mysql":
-        for name in dir(FIELD_TYPE):
-            if getattr(FIELD_TYPE, name) == code:
-                return name
-        return None
+    if conn.dialect.name == "mysql":
+        return _FIELD_TYPE_NAMES.get(code)
     else:
         raise NoSuchModuleError(conn.engine.url.get_backend_name())
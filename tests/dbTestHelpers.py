@@ -0,0 +1,105 @@
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Helpers shared by the unit tests of the db package.
+"""
+
+# standard library
+import logging as log
+import os
+
+# local
+from lsst.db import utils
+
+# scratch files are small, keep them in memory-backed /dev/shm if possible
+TMPDIR = os.environ.get("TMPDIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+# connection options for engines which are expected to fail to connect,
+# a short connect timeout keeps tests from waiting on unreachable hosts
+FAIL_FAST_QUERY = {"connect_timeout": "2"}
+
+
+def setUpLogging():
+    """
+    Log everything at DEBUG level, except sqlalchemy which would log (and
+    format) every statement and every fetched row.
+    """
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+    log.getLogger("sqlalchemy").setLevel(log.WARNING)
+
+
+def makeTestDbName(engine, tag):
+    """
+    Return name of a test database, it includes the user name of <engine>,
+    <tag> and the process id, so several test processes can share a server.
+    """
+    return "%s_dbWrapperTestDb_%s_%d" % (engine.url.username, tag, os.getpid())
+
+
+def dropTestDbs(conn):
+    """
+    Drop databases named by makeTestDbName() in this process, and those left
+    behind by test processes which no longer run (e.g. killed before their
+    cleanup), finding them all with a single query.
+
+    Liveness is checked on the local host only, a database of a test running
+    on another host with the same process id as a dead local one would be
+    dropped too.
+    """
+    # escape LIKE wildcards in the user name
+    userName = conn.engine.url.username
+    for c in "\\_%":
+        userName = userName.replace(c, "\\" + c)
+    pattern = userName + "\\_dbWrapperTestDb\\_%"
+    rows = conn.execute("SHOW DATABASES LIKE %s", (pattern,)).fetchall()
+    for row in rows:
+        if not _ownerAlive(row[0]):
+            utils.dropDb(conn, row[0], mustExist=False)
+
+
+def _ownerAlive(dbName):
+    """
+    Return True if <dbName> belongs to another test process which still runs.
+    """
+    pid = dbName.rpartition("_")[2]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but belongs to somebody else
+        pass
+    return True
+
+
+def failFastQuery(engine, query=None):
+    """
+    Return url query of <engine> extended with FAIL_FAST_QUERY and <query>.
+    """
+    result = dict(engine.url.query, **FAIL_FAST_QUERY)
+    if query:
+        result.update(query)
+    return result
@@ -29,8 +29,15 @@ The test requires credential file ~/.lsst/dbAuth-testLocal.ini with the followin
 [database]
 url = mysql+mysqldb://<userName>:<password>@localhost:13306/?unix_socket=<path to socket>
 
+Instead of the file, the url can be given in environment variable
+LSST_DB_TESTLOCAL_URL, then no file is read (tests of reading the file are
+skipped if it does not exist).
+
 User will need full mysql privileges.
 
+Database names used by the tests include the process id, so several test
+processes can share a server, e.g. "pytest -n auto" with pytest-xdist.
+
 
 @author  Jacek Becla, SLAC
 
@@ -40,50 +47,78 @@ Known issues and todos:
 """
 
 # standard library
-from configparser import NoSectionError
-import logging as log
+from configparser import NoOptionError, NoSectionError
 import os
+import sqlite3
 import tempfile
 import unittest
 
 # third party
 import sqlalchemy
+from sqlalchemy.engine.url import make_url
 
 # local
 from lsst.db.engineFactory import getEngineFromFile, getEngineFromArgs
 from lsst.db import utils
+from dbTestHelpers import TMPDIR, dropTestDbs, failFastQuery, makeTestDbName, \
+    setUpLogging
 
 
 class TestDbLocal(unittest.TestCase):
     CREDFILE = "~/.lsst/dbAuth-testLocal.ini"
+    CREDENV = "LSST_DB_TESTLOCAL_URL"
+
+    # contents of scratch files used by the tests, {db} is the database name
+    SQL_NO_DB = ("create database {db};\n"
+                 "use {db};\n"
+                 "create table t(i int);\n"
+                 "insert into t values (1), (2), (2), (5);\n")
+    SQL_WITH_DB = ("create table t(i int, d double);\n"
+                   "insert into t values (1, 1.1), (2, 2.2);\n")
+    CSV_DATA = '1\n2\n3\n4\n4\n4\n5\n3\n'
 
     @classmethod
     def setUpClass(cls):
-        log.basicConfig(
-            format='%(asctime)s %(name)s %(levelname)s: %(message)s',
-            datefmt='%m/%d/%Y %I:%M:%S',
-            level=log.DEBUG)
+        setUpLogging()
 
         credFile = os.path.expanduser(cls.CREDFILE)
-        if not os.path.isfile(credFile):
+        if cls.CREDENV not in os.environ and not os.path.isfile(credFile):
             raise unittest.SkipTest("Required file with credentials"
                                     " '{}' not found.".format(credFile))
+        # parse credentials once, tests share the engine and its connection pool
+        cls._engine = cls._getEngine()
+        cls._dbA = makeTestDbName(cls._engine, "A")
+        cls._dbB = makeTestDbName(cls._engine, "B")
+        cls._dbC = makeTestDbName(cls._engine, "C")
+        cls._sqlNoDb = cls.SQL_NO_DB.format(db=cls._dbA)
+        # connection used for cleanup between tests, kept open for all of them
+        cls._adminConn = cls._engine.connect()
 
-    def setUp(self):
-        self._engine = getEngineFromFile(self.CREDFILE)
-        self._dbA = "%s_dbWrapperTestDb_A" % self._engine.url.username
-        self._dbB = "%s_dbWrapperTestDb_B" % self._engine.url.username
-        self._dbC = "%s_dbWrapperTestDb_C" % self._engine.url.username
+    @classmethod
+    def tearDownClass(cls):
+        # do not leave databases behind for a later run to clean up
+        dropTestDbs(cls._adminConn)
+        cls._adminConn.close()
+        cls._engine.dispose()
 
-        conn = self._engine.connect()
+    @classmethod
+    def _getEngine(cls, **kwargs):
+        """
+        Return engine for the url from environment variable CREDENV if it is
+        set, from file CREDFILE otherwise. Keyword arguments override parts
+        of the url, as in getEngineFromFile().
+        """
+        if cls.CREDENV not in os.environ:
+            return getEngineFromFile(cls.CREDFILE, **kwargs)
+        url = make_url(os.environ[cls.CREDENV])
+        args = dict(drivername=url.drivername, username=url.username,
+                    password=url.password, host=url.host, port=url.port,
+                    database=url.database, query=url.query)
+        args.update(kwargs)
+        return getEngineFromArgs(**args)
 
-        if utils.dbExists(conn, self._dbA):
-            utils.dropDb(conn, self._dbA)
-        if utils.dbExists(conn, self._dbB):
-            utils.dropDb(conn, self._dbB)
-        if utils.dbExists(conn, self._dbC):
-            utils.dropDb(conn, self._dbC)
-        conn.close()
+    def setUp(self):
+        dropTestDbs(self._adminConn)
 
     def testGetEngine(self):
         """
@@ -95,6 +130,8 @@ class TestDbLocal(unittest.TestCase):
         """
         Test overwriting values from config file.
         """
+        if not os.path.isfile(os.path.expanduser(self.CREDFILE)):
+            self.skipTest("credentials file not found")
         engine = getEngineFromFile(self.CREDFILE,
                                    username="peter",
                                    password="hi")
@@ -104,7 +141,7 @@ class TestDbLocal(unittest.TestCase):
                                    host="lsst125",
                                    port="1233")
         self.assertEqual(engine.url.host, "lsst125")
-        self.assertEqual(engine.url.port, "1233")
+        self.assertEqual(engine.url.port, 1233)
         engine = getEngineFromFile(self.CREDFILE,
                                    database="myBestDB")
         self.assertEqual(engine.url.database, "myBestDB")
@@ -151,44 +188,55 @@ class TestDbLocal(unittest.TestCase):
         utils.createTable(conn, "t1", "(i int)")
         utils.dropDb(conn, self._dbB)
 
+    def _makeFailingEngine(self, query=None, **kwargs):
+        """
+        Return engine for a connection that is expected to fail.
+        """
+        return self._getEngine(query=failFastQuery(self._engine, query), **kwargs)
+
     def testConn_invalidHost1(self):
-        engine = getEngineFromFile(self.CREDFILE, host="invalidHost")
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(host="invalidHost").connect()
 
     def testConn_invalidHost2(self):
-        engine = getEngineFromFile(self.CREDFILE, host="dummyHost", port=3036)
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(host="dummyHost", port=3036).connect()
 
+    @unittest.skip("Disabled because this can work, depending on MySQL "
+                   "configuration, for example, it can default to ''@localhost")
     def testConn_invalidUserName(self):
-        # Disabling because this can work, depending on MySQL
-        # configuration, for example, it can default to ''@localhost
         pass
 
     def testConn_invalidSocket(self):
-        # make sure retry is disabled, otherwise it wil try to reconnect
-        # (it will assume the server is down and socket valid).
-        engine = getEngineFromFile(self.CREDFILE, host="localhost",
-                                   query={"unix_socket": "/x/sock"})
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(host="localhost",
+                                    query={"unix_socket": "/x/sock"}).connect()
 
     def testConn_badSocketGoodHostPort(self):
         # invalid socket, but good host/port
-        conn = getEngineFromFile(self.CREDFILE, host='127.0.0.1', query={"unix_socket": "/x/sock"}).connect()
-        conn.close()
+        engine = self._getEngine(host='127.0.0.1', query={"unix_socket": "/x/sock"})
+        engine.connect().close()
+        # throwaway engine, do not leave its pooled connection open
+        engine.dispose()
 
     def testConn_invalidOptionFile(self):
         self.assertRaises(IOError, getEngineFromFile, "/tmp/dummy.opt.file.xyz")
 
     def testConn_badOptionFile(self):
-        # start with an empty file
-        fd, fN = tempfile.mkstemp(suffix=".cnf", text=True)
+        with tempfile.NamedTemporaryFile("w", suffix=".cnf", dir=TMPDIR,
+                                         delete=False) as f:
+            fN = f.name
+            # start with an empty file
+            self.assertRaises(NoSectionError, getEngineFromFile, fN)
+
+            # add socket only
+            f.write('[client]\nsocket = /tmp/sth/wrong.sock\n')
         self.assertRaises(NoSectionError, getEngineFromFile, fN)
 
-        # add socket only
-        os.write(fd, '[client]\n')
-        os.write(fd, 'socket = /tmp/sth/wrong.sock\n')
-        os.close(fd)
-        self.assertRaises(NoSectionError, getEngineFromFile, fN)
+        # right section, but no url
+        with open(fN, 'w') as f:
+            f.write('[database]\necho = yes\n')
+        self.assertRaises(NoOptionError, getEngineFromFile, fN)
 
         os.remove(fN)
 
@@ -197,9 +245,10 @@ class TestDbLocal(unittest.TestCase):
         Try interleaving operations on multiple databases.
         """
         conn = self._engine.connect()
-        utils.createDb(conn, self._dbA)
-        utils.createDb(conn, self._dbB)
-        utils.createDb(conn, self._dbC)
+        # setup goes in one batch, the calls below are what is being tested
+        utils.execCommands(conn, ["CREATE DATABASE `%s`" % dbName
+                                  for dbName in (self._dbA, self._dbB, self._dbC)])
+        self.assertTrue(utils.dbExists(conn, self._dbC))
         utils.useDb(conn, self._dbA)
         utils.createTable(conn, "t1", "(i int)", self._dbB)
         utils.createTable(conn, "t1", "(i int)")
@@ -213,6 +262,27 @@ class TestDbLocal(unittest.TestCase):
         utils.dropDb(conn, self._dbC)
         conn.close()
 
+    def testExecCommands(self):
+        """
+        Test that errors from statements after the first one in a batch are
+        reported, and that batches run on an engine do not leak session state.
+        """
+        conn = self._engine.connect()
+        utils.execCommands(conn, [])
+        with self.assertRaises(sqlalchemy.exc.DBAPIError) as cm:
+            utils.execCommands(conn, ["CREATE DATABASE `%s`" % self._dbA,
+                                      "CREATE DATABASE `%s`" % self._dbA])
+        self.assertEqual(cm.exception.orig.args[0], utils.MySqlErr.ER_DB_CREATE_EXISTS)
+        self.assertTrue(utils.dbExists(conn, self._dbA))
+        conn.close()
+
+        utils.execCommands(self._engine, ["USE `%s`" % self._dbA])
+        conn = self._engine.connect()
+        self.assertEqual(conn.execute("SELECT DATABASE()").scalar(),
+                         self._engine.url.database)
+        utils.dropDb(conn, self._dbA)
+        conn.close()
+
     def testListTables(self):
         conn = self._engine.connect()
         utils.createDb(conn, self._dbA)
@@ -225,7 +295,7 @@ class TestDbLocal(unittest.TestCase):
         ret = utils.listTables(conn, self._dbB)
         self.assertEqual(len(ret), 0)
 
-        conn = getEngineFromFile(self.CREDFILE, database=self._dbA).connect()
+        conn = self._getEngine(database=self._dbA).connect()
         ret = utils.listTables(conn)
         self.assertEqual(len(ret), 2)
         self.assertIn("t1", ret)
@@ -241,6 +311,34 @@ class TestDbLocal(unittest.TestCase):
         ret = conn.execute("SELECT * FROM t1")
         self.assertEqual(len(ret.keys()), 2)
 
+    def testIterQuery(self):
+        """
+        Test streaming rows, in several fetches and with the iterator closed
+        before all rows are read.
+        """
+        conn = self._engine.connect()
+        utils.createDb(conn, self._dbA)
+        utils.useDb(conn, self._dbA)
+        utils.createTable(conn, "t1", "(i int)")
+        conn.execute("INSERT INTO t1 VALUES (%s)", [(i,) for i in range(25)])
+
+        rows = utils.iterQuery(conn, "SELECT i FROM t1 ORDER BY i", arraysize=10)
+        self.assertEqual([row[0] for row in rows], list(range(25)))
+
+        rows = utils.iterQuery(conn, "SELECT i FROM t1 WHERE i > %s ORDER BY i",
+                               (20,), arraysize=2)
+        self.assertEqual(next(rows)[0], 21)
+        rows.close()
+        self.assertEqual(list(rows), [])
+        # connection is usable again once the iterator is closed
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM t1").scalar(), 25)
+
+        # errors are raised by the call, not on first next()
+        self.assertRaises(sqlalchemy.exc.DBAPIError,
+                          utils.iterQuery, conn, "SELECT dummy FROM t1")
+        utils.dropDb(conn, self._dbA)
+        conn.close()
+
     def testMultiCreateDef(self):
         """
         Test creating db/table that already exists (in default db).
@@ -315,12 +413,12 @@ class TestDbLocal(unittest.TestCase):
                           utils.dropTable, conn, "t2", self._dbB)
         utils.dropDb(conn, self._dbB)
 
-        # mix of current and not current db
-        utils.createDb(conn, self._dbA)
-        utils.createDb(conn, self._dbB)
-        utils.useDb(conn, self._dbA)
-        utils.createTable(conn, "t2", "(i int)", self._dbB)
-        utils.createTable(conn, "t2", "(i int)")
+        # mix of current and not current db, set up in one batch
+        utils.execCommands(conn, ["CREATE DATABASE `%s`" % self._dbA,
+                                  "CREATE DATABASE `%s`" % self._dbB,
+                                  "USE `%s`" % self._dbA,
+                                  "CREATE TABLE `%s`.t2 (i int)" % self._dbB,
+                                  "CREATE TABLE t2 (i int)"])
 
         utils.dropTable(conn, "t2")
         utils.dropTable(conn, "t2", dbName=self._dbB)
@@ -354,7 +452,7 @@ class TestDbLocal(unittest.TestCase):
         self.assertFalse(utils.dbExists(conn, "bla"))
         self.assertTrue(utils.tableExists(conn, "t1", self._dbA))
         # utils.useDb(conn, self._dbA)
-        conn = getEngineFromFile(self.CREDFILE, database=self._dbA).connect()
+        conn = self._getEngine(database=self._dbA).connect()
         self.assertTrue(utils.tableExists(conn, "t1"))
         self.assertFalse(utils.tableExists(conn, "bla"))
         self.assertFalse(utils.tableExists(conn, "bla", "blaBla"))
@@ -365,6 +463,30 @@ class TestDbLocal(unittest.TestCase):
 
         conn.close()
 
+    def testCheckExistsCached(self):
+        """
+        Test that with caching enabled existence checks are answered from
+        the cache until databases or tables are created or dropped through utils.
+        """
+        utils.setMetaCacheTtl(60)
+        self.addCleanup(utils.setMetaCacheTtl, 0)
+        conn = self._engine.connect()
+        self.assertFalse(utils.dbExists(conn, self._dbA))
+        self.assertFalse(utils.tableExists(conn, "t1", self._dbA))
+
+        # created behind the back of utils, cached answer is still returned
+        conn.execute("CREATE DATABASE `%s`" % self._dbA)
+        self.assertFalse(utils.dbExists(conn, self._dbA))
+
+        utils.createTable(conn, "t1", "(i int)", self._dbA)
+        self.assertTrue(utils.dbExists(conn, self._dbA))
+        self.assertTrue(utils.tableExists(conn, "t1", self._dbA))
+        utils.dropTable(conn, "t1", self._dbA)
+        self.assertFalse(utils.tableExists(conn, "t1", self._dbA))
+        utils.dropDb(conn, self._dbA)
+        self.assertFalse(utils.dbExists(conn, self._dbA))
+        conn.close()
+
     def testOptParams(self):
         """
         Testing optional parameter binding.
@@ -405,12 +527,10 @@ class TestDbLocal(unittest.TestCase):
         utils.dropDb(conn, self._dbB)
 
     def testLoadSqlScriptNoDb(self):
-        fd, fN = tempfile.mkstemp(suffix=".csv", text=True)
-        os.write(fd, "create database %s;\n" % self._dbA)
-        os.write(fd, "use %s;\n" % self._dbA)
-        os.write(fd, "create table t(i int);\n")
-        os.write(fd, "insert into t values (1), (2), (2), (5);\n")
-        os.close(fd)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=TMPDIR,
+                                         delete=False) as f:
+            f.write(self._sqlNoDb)
+        fN = f.name
         conn = self._engine.connect()
         utils.loadSqlScript(conn, fN)
         self.assertEqual(10, conn.execute("select sum(i) from %s.t" % self._dbA).first()[0])
@@ -419,10 +539,10 @@ class TestDbLocal(unittest.TestCase):
         os.remove(fN)
 
     def testLoadSqlScriptWithDb(self):
-        fd, fN = tempfile.mkstemp(suffix=".csv", text=True)
-        os.write(fd, "create table t(i int, d double);\n")
-        os.write(fd, "insert into t values (1, 1.1), (2, 2.2);\n")
-        os.close(fd)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=TMPDIR,
+                                         delete=False) as f:
+            f.write(self.SQL_WITH_DB)
+        fN = f.name
         conn = self._engine.connect()
         utils.createDb(conn, self._dbA)
         utils.loadSqlScript(conn, fN, self._dbA)
@@ -435,25 +555,25 @@ class TestDbLocal(unittest.TestCase):
         """
         Testing "LOAD DATA INFILE..."
         """
-        fd, fN = tempfile.mkstemp(suffix=".csv", text=True)
-        os.write(fd, '1\n2\n3\n4\n4\n4\n5\n3\n')
-        os.close(fd)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=TMPDIR,
+                                         delete=False) as f:
+            f.write(self.CSV_DATA)
+        fN = f.name
 
         query = self._engine.url.query.copy()
         query['local_infile'] = '1'
-        conn = getEngineFromFile(self.CREDFILE, query=query).connect()
+        conn = self._getEngine(query=query).connect()
         utils.createDb(conn, self._dbA)
         utils.useDb(conn, self._dbA)
         utils.createTable(conn, "t1", "(i int)")
         conn.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE t1" % fN)
-        x = conn.execute("SELECT COUNT(*) FROM t1")
-        self.assertEqual(8, conn.execute("SELECT COUNT(*) FROM t1").first()[0])
+        count = conn.execute("SELECT COUNT(*) FROM t1").scalar()
+        self.assertEqual(count, 8)
         self.assertEqual(3, conn.execute("SELECT COUNT(*) FROM t1 WHERE i=4").first()[0])
 
         # let's add some confusing data to the loaded file, it will get truncated
-        f = open(fN, 'w')
-        f.write('11,12,13,14\n2')
-        f.close()
+        with open(fN, 'w') as f:
+            f.write('11,12,13,14\n2')
         conn.execute("LOAD DATA LOCAL INFILE '%s' INTO TABLE t1" % fN)
 
         utils.dropDb(conn, self._dbA)
@@ -461,5 +581,25 @@ class TestDbLocal(unittest.TestCase):
         os.remove(fN)
 
 
+
+class TestEngineArgs(unittest.TestCase):
+    """
+    Tests of engine arguments, they do not need a server.
+    """
+
+    def testPoolRecycle(self):
+        engine = getEngineFromArgs(drivername="sqlite")
+        self.assertEqual(engine.pool._recycle, 3600)
+        engine = getEngineFromArgs(drivername="sqlite", pool_recycle=10)
+        self.assertEqual(engine.pool._recycle, 10)
+
+    def testOwnPool(self):
+        pool = sqlalchemy.pool.QueuePool(lambda: sqlite3.connect(":memory:"))
+        engine = getEngineFromArgs(drivername="sqlite", pool=pool)
+        self.assertIs(engine.pool, pool)
+        self.assertEqual(engine.execute("SELECT 1").scalar(), 1)
+        engine.dispose()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -31,13 +31,15 @@ url = mysql+mysqldb://<userName>:<password>@127.0.0.1:13306/
 
 It is sufficient if the user has normal privileges.
 
+Database names used by the tests include the process id, so several test
+processes can share a server, e.g. "pytest -n auto" with pytest-xdist.
+
 
 @author  Jacek Becla, SLAC
 
 """
 
 # standard library
-import logging as log
 import os
 import unittest
 
@@ -47,6 +49,7 @@ import sqlalchemy
 # local
 from lsst.db.engineFactory import getEngineFromFile, getEngineFromArgs
 from lsst.db import utils
+from dbTestHelpers import dropTestDbs, failFastQuery, makeTestDbName, setUpLogging
 
 
 class TestDbRemote(unittest.TestCase):
@@ -54,30 +57,26 @@ class TestDbRemote(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        log.basicConfig(
-            format='%(asctime)s %(name)s %(levelname)s: %(message)s',
-            datefmt='%m/%d/%Y %I:%M:%S',
-            level=log.DEBUG)
+        setUpLogging()
 
         credFile = os.path.expanduser(cls.CREDFILE)
         if not os.path.isfile(credFile):
             raise unittest.SkipTest("Required file with credentials"
                                     " '{}' not found.".format(credFile))
+        cls._engine = getEngineFromFile(cls.CREDFILE)
+        cls._dbA = makeTestDbName(cls._engine, "A")
+        cls._dbB = makeTestDbName(cls._engine, "B")
+        cls._dbC = makeTestDbName(cls._engine, "C")
+        cls._adminConn = cls._engine.connect()
 
-    def setUp(self):
-        self._engine = getEngineFromFile(self.CREDFILE)
-        self._dbA = "%s_dbWrapperTestDb_A" % self._engine.url.username
-        self._dbB = "%s_dbWrapperTestDb_B" % self._engine.url.username
-        self._dbC = "%s_dbWrapperTestDb_C" % self._engine.url.username
+    @classmethod
+    def tearDownClass(cls):
+        dropTestDbs(cls._adminConn)
+        cls._adminConn.close()
+        cls._engine.dispose()
 
-        conn = self._engine.connect()
-        if utils.dbExists(conn, self._dbA):
-            utils.dropDb(conn, self._dbA)
-        if utils.dbExists(conn, self._dbB):
-            utils.dropDb(conn, self._dbB)
-        if utils.dbExists(conn, self._dbC):
-            utils.dropDb(conn, self._dbC)
-        conn.close()
+    def setUp(self):
+        dropTestDbs(self._adminConn)
 
     def testBasicOptionFileConn(self):
         conn = self._engine.connect()
@@ -102,25 +101,32 @@ class TestDbRemote(unittest.TestCase):
         utils.dropDb(conn, self._dbA)
         conn.close()
 
+    def _makeFailingEngine(self, query=None, **kwargs):
+        """
+        Return engine for a connection that is expected to fail.
+        """
+        return getEngineFromFile(self.CREDFILE, query=failFastQuery(self._engine, query),
+                                 **kwargs)
+
     def testConn_invalidHost1(self):
-        engine = getEngineFromFile(self.CREDFILE, host="invalidHost")
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(host="invalidHost").connect()
 
     def testConn_invalidHost2(self):
-        engine = getEngineFromFile(self.CREDFILE, host="dummyHost", port=3036)
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(host="dummyHost", port=3036).connect()
 
     def testConn_invalidPortNo(self):
-        engine = getEngineFromFile(self.CREDFILE, port=987654)
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(port=987654).connect()
 
     def testConn_wrongPortNo(self):
-        engine = getEngineFromFile(self.CREDFILE, port=1579)
-        self.assertRaises(sqlalchemy.exc.OperationalError, engine.connect)
+        with self.assertRaises(sqlalchemy.exc.OperationalError):
+            self._makeFailingEngine(port=1579).connect()
 
+    @unittest.skip("Disabled because this can work, depending on MySQL "
+                   "configuration, for example, it can default to ''@localhost")
     def testConn_invalidUserName(self):
-        # Disabling because this can work, depending on MySQL
-        # configuration, for example, it can default to ''@localhost
         pass
 
     def testCheckExists(self):
@@ -36,9 +36,9 @@ import os
 import tempfile
 import unittest
 
-import lsst.log as log
 from lsst.db.engineFactory import getEngineFromFile
 from lsst.db import utils
+from dbTestHelpers import TMPDIR, dropTestDbs, makeTestDbName
 
 
 class TestUtils(unittest.TestCase):
@@ -50,38 +50,84 @@ class TestUtils(unittest.TestCase):
         if not os.path.isfile(credFile):
             raise unittest.SkipTest("Required file with credentials"
                                     " '{}' not found.".format(credFile))
+        cls._engine = getEngineFromFile(cls.CREDFILE)
+        cls._dbName = makeTestDbName(cls._engine, "Utils")
+        cls._script = '\n'.join(["create database %s;" % cls._dbName,
+                                 "use %s;" % cls._dbName,
+                                 "create table t(i int);",
+                                 "insert into t values (1), (2), (2), (5);"])
 
-    def testLoadSqlScriptFromObject(self):
-        conn = getEngineFromFile(self.CREDFILE).connect()
-        dbName = "%s_dbWrapperTestDb" % conn.engine.url.username
+    @classmethod
+    def tearDownClass(cls):
+        with cls._engine.connect() as conn:
+            dropTestDbs(conn)
+        cls._engine.dispose()
 
-        commands = ["create database %s;" % dbName,
-                    "use %s;" % dbName,
-                    "create table t(i int);",
-                    "insert into t values (1), (2), (2), (5);"]
+    def setUp(self):
+        with self._engine.connect() as conn:
+            dropTestDbs(conn)
+
+    def testLoadSqlScriptFromObject(self):
+        conn = self._engine.connect()
 
         # make file object and pass it to loadSqlScript
-        script = tempfile.TemporaryFile()
-        script.write('\n'.join(commands))
+        script = tempfile.TemporaryFile("w+", dir=TMPDIR)
+        script.write(self._script)
         script.seek(0)
         utils.loadSqlScript(conn, script)
-        utils.dropDb(conn, dbName)
+        utils.dropDb(conn, self._dbName)
+        conn.close()
 
     def testLoadSqlScriptFromPath(self):
-        conn = getEngineFromFile(self.CREDFILE).connect()
-        dbName = "%s_dbWrapperTestDb" % conn.engine.url.username
-
-        commands = ["create database %s;" % dbName,
-                    "use %s;" % dbName,
-                    "create table t(i int);",
-                    "insert into t values (1), (2), (2), (5);"]
+        conn = self._engine.connect()
 
         # make file but pass the name of that file to loadSqlScript
-        script = tempfile.NamedTemporaryFile()
-        script.write('\n'.join(commands))
+        script = tempfile.NamedTemporaryFile("w+", dir=TMPDIR)
+        script.write(self._script)
         script.seek(0)
         utils.loadSqlScript(conn, script.name)
-        utils.dropDb(conn, dbName)
+        utils.dropDb(conn, self._dbName)
+        conn.close()
+
+    def testLoadSqlScriptSubprocess(self):
+        conn = self._engine.connect()
+
+        # same script, run through the mysql command line client
+        script = tempfile.TemporaryFile("w+", dir=TMPDIR)
+        script.write(self._script)
+        script.seek(0)
+        utils.loadSqlScript(conn, script, useSubprocess=True)
+        self.assertEqual(10, conn.execute("SELECT SUM(i) FROM %s.t" % self._dbName).scalar())
+        utils.dropDb(conn, self._dbName)
+        conn.close()
+
+    def testLoadSqlScriptComments(self):
+        """
+        Test script with comments in all places, including at the very end,
+        and check it does not change the current database of the connection.
+        """
+        conn = self._engine.connect()
+        currentDb = conn.execute("SELECT DATABASE()").scalar()
+
+        script = tempfile.TemporaryFile("w+", dir=TMPDIR)
+        script.write("-- leading comment\n# another one\n")
+        script.write(self._script)
+        script.write(" -- done\n")
+        script.write("insert into t select length('-- #') - 4 /* inline */; # trailing\n")
+        script.write("select /*+ MAX_EXECUTION_TIME(10000) */ count(*) from t;\n")
+        script.write("/* trailing\n   block */\n")
+        script.seek(0)
+        utils.loadSqlScript(conn, script)
+        self.assertEqual(10, conn.execute("SELECT SUM(i) FROM %s.t" % self._dbName).scalar())
+        self.assertEqual(currentDb, conn.execute("SELECT DATABASE()").scalar())
+        utils.dropDb(conn, self._dbName)
+        conn.close()
+
+        # optimizer hints and executable comments are not comments to mysql
+        self.assertEqual(utils._stripSqlComments("SELECT /*+ NO_ICP(t) */ 1 /* x */"),
+                         "SELECT /*+ NO_ICP(t) */ 1")
+        self.assertEqual(utils._stripSqlComments("/*!40101 SET @x=1 */; -- x"),
+                         "/*!40101 SET @x=1 */;")
 
 
 if __name__ == "__main__":